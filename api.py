@@ -1,14 +1,24 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel
 from typing import Tuple, Optional, Dict
+import logging
 import aiohttp
+import anyio.to_thread
+import orjson
+from cachetools import TTLCache
 from sqlalchemy.orm import Session
 from yarl import URL
 from database import *
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 
-app = FastAPI(title="Velobike API Gateway", version="1.0")
+app = FastAPI(
+    title="Velobike API Gateway",
+    version="1.0",
+    default_response_class=ORJSONResponse,
+)
 
 
 # ---------------------------
@@ -63,21 +73,48 @@ class RentStatusQuery(BaseModel):
     deviceId: str
 
 
+class LatLon(BaseModel):
+    latitude: float
+    longitude: float
+
+
 class TransportsRequest(BaseModel):
     login: str = "2757073"
-    northEast: Dict[str, float]  # например: {"latitude": 55.75, "longitude": 37.62}
-    southWest: Dict[str, float]
+    northEast: LatLon  # например: {"latitude": 55.75, "longitude": 37.62}
+    southWest: LatLon
 
 
 # ---------------------------
 # Функция для получения аккаунта из БД
 # ---------------------------
-def get_account_by_login(login: str) -> Account:
-    session: Session = get_session()
+# Токен и cookie аккаунта меняются редко, поэтому найденные аккаунты
+# кэшируются на минуту, чтобы не ходить в БД на каждый запрос.
+# Их обновляет refresh.py в отдельном процессе, который этот кэш не видит:
+# после обновления API еще до 60 секунд отправляет прежние token и cookie.
+ACCOUNT_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=60)
+
+
+# Готовые заголовки запросов к сервису для каждого логина
+_ACCOUNT_HEADERS: Dict[str, dict] = {}
+
+
+def build_account_headers(account: Account) -> dict:
+    # Формируем заголовки, включая актуальный токен
+    headers = {**HEADERS, "Authorization": "Bearer " + account.token}
+    _ACCOUNT_HEADERS[account.login] = headers
+    return headers
+
+
+def _load_account(login: str) -> Optional[Account]:
+    # Сессия из реестра переиспользуется, соединение берется из пула
+    session: Session = ScopedSession()
     try:
         account = session.query(Account).filter(Account.login == login).first()
         if account is None:
             logger.info(f"Account with login '{login}' not found.")
+        else:
+            # Отвязываем объект, чтобы вызывающий код не держал соединение
+            session.expunge(account)
         return account
     except Exception as e:
         logger.error(f"Error retrieving account '{login}': {e}")
@@ -86,18 +123,158 @@ def get_account_by_login(login: str) -> Account:
         session.close()
 
 
+async def get_account_by_login(login: str) -> Optional[Account]:
+    account = ACCOUNT_CACHE.get(login)
+    if account is not None:
+        return account
+    # Синхронный запрос к БД выполняется в пуле потоков, не блокируя event loop
+    account = await run_in_threadpool(_load_account, login)
+    if account is not None:
+        ACCOUNT_CACHE[login] = account
+        build_account_headers(account)
+    return account
+
+
 # ---------------------------
-# Вспомогательная функция: создание aiohttp сессии с данными аккаунта
+# Вспомогательная функция: aiohttp сессия с данными аккаунта
 # ---------------------------
-def get_service_session(account: Account) -> aiohttp.ClientSession:
-    # Формируем заголовки, включая актуальный токен
-    headers = HEADERS.copy()
-    headers["Authorization"] = "Bearer " + account.token
-    jar = aiohttp.CookieJar()
-    jar.update_cookies(
-        {"qrator_jsid": account.cookie}, response_url=URL("https://pwa.velobike.ru")
+# Сессии кэшируются по логину и живут до остановки приложения,
+# чтобы не устанавливать TCP/TLS соединение заново на каждый запрос
+_SESSIONS: Dict[str, aiohttp.ClientSession] = {}
+VELOBIKE_URL = URL("https://pwa.velobike.ru")
+# Общий пул соединений для всех аккаунтов: весь трафик идет на один хост,
+# поэтому keep-alive сокеты переиспользуются между сессиями.
+# aiohttp работает только по HTTP/1.1, поэтому мультиплексирования, как в
+# HTTP/2, нет: параллельные запросы берут разные сокеты из этого пула, а
+# TLS-рукопожатие выполняется только при открытии нового сокета.
+# Создается лениво, т.к. коннектору нужен запущенный event loop.
+CONNECTOR: Optional[aiohttp.TCPConnector] = None
+
+
+def get_connector() -> aiohttp.TCPConnector:
+    global CONNECTOR
+    if CONNECTOR is None or CONNECTOR.closed:
+        # Весь трафик идет на один хост: адрес резолвится асинхронно (aiodns,
+        # без getaddrinfo в пуле потоков) и кэшируется на час
+        CONNECTOR = aiohttp.TCPConnector(
+            limit=200,
+            limit_per_host=64,
+            keepalive_timeout=60,
+            enable_cleanup_closed=True,
+            resolver=aiohttp.AsyncResolver(),
+            use_dns_cache=True,
+            ttl_dns_cache=3600,
+        )
+    return CONNECTOR
+
+
+def _json_dumps(obj) -> str:
+    # aiohttp ожидает str от сериализатора, orjson возвращает bytes
+    return orjson.dumps(obj).decode()
+
+
+async def get_service_session(account: Account) -> aiohttp.ClientSession:
+    headers = _ACCOUNT_HEADERS.get(account.login) or build_account_headers(account)
+    session = _SESSIONS.get(account.login)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            headers=headers,
+            cookie_jar=aiohttp.CookieJar(),
+            connector=get_connector(),
+            connector_owner=False,
+            json_serialize=_json_dumps,
+        )
+        _SESSIONS[account.login] = session
+    elif session.headers["Authorization"] == headers["Authorization"]:
+        return session
+    else:
+        # Токен мог быть обновлен (refresh.py) с момента создания сессии
+        session.headers["Authorization"] = headers["Authorization"]
+    session.cookie_jar.update_cookies(
+        {"qrator_jsid": account.cookie}, response_url=VELOBIKE_URL
     )
-    return aiohttp.ClientSession(headers=headers, cookie_jar=jar)
+    return session
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    # Запросы к БД выполняются в пуле потоков anyio; лимита по умолчанию (40)
+    # не хватает при всплесках параллельных запросов
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 200
+
+
+@app.on_event("shutdown")
+async def close_service_sessions():
+    for session in _SESSIONS.values():
+        await session.close()
+    _SESSIONS.clear()
+    if CONNECTOR is not None:
+        await CONNECTOR.close()
+
+
+@app.on_event("shutdown")
+def dispose_engine():
+    ScopedSession.remove()
+    engine.dispose()
+
+
+class UploadFilePayload(aiohttp.payload.IOBasePayload):
+    """
+    Содержимое UploadFile для отправки в multipart по частям.
+    До Python 3.11 SpooledTemporaryFile не наследует io.IOBase, и FormData
+    не может сериализовать его сам, поэтому файл оборачивается явно.
+    Размер берется из UploadFile.size, чтобы запрос ушел с Content-Length
+    без chunked-кодирования: aiohttp определяет размер файла через fileno(),
+    а это сбрасывает SpooledTemporaryFile из памяти на диск.
+    """
+
+    def __init__(self, file: UploadFile, **kwargs):
+        super().__init__(file.file, **kwargs)
+        self._upload_size = file.size
+
+    @property
+    def size(self) -> Optional[int]:
+        return self._upload_size
+
+
+# ---------------------------
+# Вспомогательная функция: разбор ответа сервиса
+# ---------------------------
+async def upstream_json(
+    resp: aiohttp.ClientResponse, endpoint: str, log_data: bool = True
+):
+    """
+    Возвращает JSON из успешного ответа сервиса.
+    При любом другом статусе выбрасывает HTTPException с текстом ответа.
+    """
+    if resp.status == 200:
+        # Для пустого тела resp.json возвращает None, а не ошибку разбора
+        data = await resp.json(loads=orjson.loads)
+        if log_data:
+            logger.debug("%s response: %s", endpoint, data)
+        return data
+    detail = await resp.text()
+    logger.debug("%s error: %s", endpoint, detail)
+    raise HTTPException(status_code=resp.status, detail=detail)
+
+
+# ---------------------------
+# Адреса методов сервиса (шаблоны собираются один раз при импорте)
+# ---------------------------
+VELOBIKE_API = "https://pwa.velobike.ru/api"
+URL_SEARCH = VELOBIKE_API + "/iot/cache/vehicles/search"
+URL_VEHICLE = (VELOBIKE_API + "/iot/cache/vehicles/{}").format
+URL_RENTS = VELOBIKE_API + "/rent/rents"
+URL_NOT_FINISHED = URL_RENTS + "/not-finished/user"
+URL_FINISH_RENT = (URL_RENTS + "/{}/finishRent").format
+URL_FINISH_AFTER_UPLOAD = (URL_RENTS + "/{}/finishRentAfterUploadPhoto").format
+URL_OPEN_OMNI_LOCK = (URL_RENTS + "/{}/commands/openOmniLock").format
+URL_OPEN_CHAIN_LOCK = (URL_RENTS + "/{}/commands/openChainLock").format
+URL_PARK = (URL_RENTS + "/{}/commands/parkBikeToParking").format
+URL_RENT_STATUS = (URL_RENTS + "/{}/checkRentStatus?frameNumber={}").format
+URL_UPLOAD_PHOTO = (VELOBIKE_API + "/rent/files/{}/uploadPhoto?deviceId={}").format
+# Команда открытия замка по типу замка
+LOCK_URLS = {"omni": URL_OPEN_OMNI_LOCK, "chain": URL_OPEN_CHAIN_LOCK}
 
 
 # ---------------------------
@@ -110,7 +287,7 @@ async def list_accounts():
     Возвращает список всех аккаунтов из базы данных.
     """
     try:
-        accounts = get_all_accounts()
+        accounts = await run_in_threadpool(get_all_accounts)
         # Преобразуем аккаунты в список словарей с нужными полями
         accounts_data = [
             {"login": acc.login, "cookie": acc.cookie, "token": acc.token}
@@ -122,6 +299,11 @@ async def list_accounts():
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+# Неизменяемые части тела запроса поиска
+SEARCH_INVENTORY_STATUS = ("IN_CITY",)
+SEARCH_OPERATIVE_STATUSES = ("STATIONED", "INACTIVE")
+
+
 @app.post("/api/v1/search")
 async def api_search(req: TransportsRequest):
     """
@@ -134,35 +316,27 @@ async def api_search(req: TransportsRequest):
           "southWest": {"latitude": float, "longitude": float}
       }
     """
-    # Извлекаем кортежи координат (предполагается, что словари содержат два значения)
-    necorner = tuple(req.northEast.values())
-    swcorner = tuple(req.southWest.values())
-    logger.info(f"Search request for {req.login} with bounds {necorner} / {swcorner}")
+    ne, sw = req.northEast, req.southWest
+    logger.info(f"Search request for {req.login} with bounds {ne} / {sw}")
 
-    account = get_account_by_login(req.login)
+    account = await get_account_by_login(req.login)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
 
     json_payload = {
-        "inventoryStatus": ["IN_CITY"],
-        "operativeStatuses": ["STATIONED", "INACTIVE"],
+        "inventoryStatus": SEARCH_INVENTORY_STATUS,
+        "operativeStatuses": SEARCH_OPERATIVE_STATUSES,
         "boundingBox": {
-            "swCorner": {"longitude": swcorner[1], "latitude": swcorner[0]},
-            "neCorner": {"longitude": necorner[1], "latitude": necorner[0]},
+            "swCorner": {"longitude": sw.longitude, "latitude": sw.latitude},
+            "neCorner": {"longitude": ne.longitude, "latitude": ne.latitude},
         },
     }
-    async with get_service_session(account) as session:
-        async with session.post(
-            "https://pwa.velobike.ru/api/iot/cache/vehicles/search", json=json_payload
-        ) as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                # logger.debug(f"/api/v1/search response: {data}")  # Added debug log
-                return data.get("values", [])
-            else:
-                detail = await resp.text()
-                logger.debug(f"/api/v1/search error: {detail}")  # Added debug log
-                raise HTTPException(status_code=resp.status, detail=detail)
+    session = await get_service_session(account)
+    async with session.post(URL_SEARCH, json=json_payload) as resp:
+        # Список велосипедов большой, поэтому в лог он не пишется
+        data = await upstream_json(resp, "/api/v1/search", log_data=False)
+    # Ответ отдается напрямую, минуя jsonable_encoder FastAPI
+    return ORJSONResponse(data.get("values", []))
 
 
 @app.get("/api/v1/vehicle/{vehicle_id}")
@@ -172,29 +346,16 @@ async def get_vehicle(vehicle_id: str, login: str = Query(...)):
     Возвращает информацию о конкретном велосипеде.
     """
     logger.info(f"Vehicle data request for vehicle {vehicle_id} by {login}")
-    account = get_account_by_login(login)
+    account = await get_account_by_login(login)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-    url = f"https://pwa.velobike.ru/api/iot/cache/vehicles/{vehicle_id}"
-    async with get_service_session(account) as session:
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                logger.debug(
-                    f"/api/v1/vehicle/{vehicle_id} response: {data}"
-                )  # Added debug log
-                return data
-            elif resp.status == 404:
-                logger.debug(
-                    f"/api/v1/vehicle/{vehicle_id} not found"
-                )  # Added debug log
-                return {"status": False}
-            else:
-                detail = await resp.text()
-                logger.debug(
-                    f"/api/v1/vehicle/{vehicle_id} error: {detail}"
-                )  # Added debug log
-                raise HTTPException(status_code=resp.status, detail=detail)
+    url = URL_VEHICLE(vehicle_id)
+    session = await get_service_session(account)
+    async with session.get(url) as resp:
+        if resp.status == 404:
+            logger.debug("/api/v1/vehicle/%s not found", vehicle_id)
+            return {"status": False}
+        return await upstream_json(resp, "/api/v1/vehicle")
 
 
 @app.post("/api/v1/rent/finish")
@@ -206,27 +367,17 @@ async def finish_rent(finish_req: FinishRentRequest):
     logger.info(
         f"Finish rent request from {finish_req.login} for rent {finish_req.rentId}"
     )
-    account = get_account_by_login(finish_req.login)
+    account = await get_account_by_login(finish_req.login)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-    url = f"https://pwa.velobike.ru/api/rent/rents/{finish_req.rentId}/finishRent"
+    url = URL_FINISH_RENT(finish_req.rentId)
     payload = {"clientGeoPosition": finish_req.clientGeoPosition}
-    async with get_service_session(account) as session:
-        async with session.post(url, json=payload) as resp:
-            if resp.status == 200:
-                json_data = await resp.json()
-                logger.debug(
-                    f"/api/v1/rent/finish response: {json_data}"
-                )  # Added debug log
-                return json_data
-            elif resp.status == 404:
-                json_data = await resp.json()
-                logger.debug(f"/api/v1/rent/finish error: {json_data}")
-                return False
-            else:
-                detail = await resp.text()
-                logger.debug(f"/api/v1/rent/finish error: {detail}")  # Added debug log
-                raise HTTPException(status_code=resp.status, detail=detail)
+    session = await get_service_session(account)
+    async with session.post(url, json=payload) as resp:
+        if resp.status == 404:
+            logger.debug("/api/v1/rent/finish error: %s", await resp.text())
+            return False
+        return await upstream_json(resp, "/api/v1/rent/finish")
 
 
 @app.post("/api/v1/rent/upload_photo")
@@ -241,34 +392,26 @@ async def upload_photo(
     Загружает фото для завершения аренды.
     """
     logger.info(f"Upload photo request from {login} for rent {rentId}")
-    account = get_account_by_login(login)
+    account = await get_account_by_login(login)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-    url = f"https://pwa.velobike.ru/api/rent/files/{rentId}/uploadPhoto?deviceId={deviceId}"
+    url = URL_UPLOAD_PHOTO(rentId, deviceId)
     # Формируем multipart/form-data
+    # Файл передается как есть: aiohttp читает его по частям при отправке,
+    # не загружая все содержимое в память
     form = aiohttp.FormData()
-    contents = await file.read()
-    form.add_field(
-        "photo", contents, filename=f"{rentId}.jpg", content_type="image/jpeg"
-    )
-    async with get_service_session(account) as session:
-        async with session.post(url, data=form) as resp:
-            if resp.status == 200:
-                json_data = await resp.json()
-                logger.debug(
-                    f"/api/v1/rent/upload_photo response: {json_data}"
-                )  # Added debug log
-                return {
-                    "message": "Photo uploaded successfully",
-                    "rentId": rentId,
-                    "data": json_data,
-                }
-            else:
-                detail = await resp.text()
-                logger.debug(
-                    f"/api/v1/rent/upload_photo error: {detail}"
-                )  # Added debug log
-                raise HTTPException(status_code=resp.status, detail=detail)
+    await file.seek(0)
+    filename = f"{rentId}.jpg"
+    photo = UploadFilePayload(file, filename=filename, content_type="image/jpeg")
+    form.add_field("photo", photo, filename=filename)
+    session = await get_service_session(account)
+    async with session.post(url, data=form) as resp:
+        json_data = await upstream_json(resp, "/api/v1/rent/upload_photo")
+    return {
+        "message": "Photo uploaded successfully",
+        "rentId": rentId,
+        "data": json_data,
+    }
 
 
 @app.post("/api/v1/rent/open_lock")
@@ -280,34 +423,22 @@ async def open_lock(open_lock_req: OpenLockRequest):
     logger.info(
         f"Open lock request from {open_lock_req.login} for rent {open_lock_req.rentId} with lock type {open_lock_req.lockType}"
     )
-    account = get_account_by_login(open_lock_req.login)
+    account = await get_account_by_login(open_lock_req.login)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-    if open_lock_req.lockType.lower() == "omni":
-        url = f"https://pwa.velobike.ru/api/rent/rents/{open_lock_req.rentId}/commands/openOmniLock"
-    elif open_lock_req.lockType.lower() == "chain":
-        url = f"https://pwa.velobike.ru/api/rent/rents/{open_lock_req.rentId}/commands/openChainLock"
-    else:
+    lock_url = LOCK_URLS.get(open_lock_req.lockType.lower())
+    if lock_url is None:
         raise HTTPException(status_code=400, detail="Invalid lock type")
+    url = lock_url(open_lock_req.rentId)
     payload = {"deviceId": open_lock_req.deviceId}
-    async with get_service_session(account) as session:
-        async with session.post(url, json=payload) as resp:
-            if resp.status == 200:
-                json_data = await resp.json()
-                logger.debug(
-                    f"/api/v1/rent/open_lock response: {json_data}"
-                )  # Added debug log
-                return {
-                    "message": f"{open_lock_req.lockType.capitalize()} lock opened successfully",
-                    "rentId": open_lock_req.rentId,
-                    "data": json_data,
-                }
-            else:
-                detail = await resp.text()
-                logger.debug(
-                    f"/api/v1/rent/open_lock error: {detail}"
-                )  # Added debug log
-                raise HTTPException(status_code=resp.status, detail=detail)
+    session = await get_service_session(account)
+    async with session.post(url, json=payload) as resp:
+        json_data = await upstream_json(resp, "/api/v1/rent/open_lock")
+    return {
+        "message": f"{open_lock_req.lockType.capitalize()} lock opened successfully",
+        "rentId": open_lock_req.rentId,
+        "data": json_data,
+    }
 
 
 @app.post("/api/v1/rent/park")
@@ -317,40 +448,32 @@ async def park_bike(park_req: ParkRequest):
     Паркует велосипед.
     """
     logger.info(f"Park bike request from {park_req.login} for rent {park_req.rentId}")
-    account = get_account_by_login(park_req.login)
+    account = await get_account_by_login(park_req.login)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-    url = f"https://pwa.velobike.ru/api/rent/rents/{park_req.rentId}/commands/parkBikeToParking"
+    url = URL_PARK(park_req.rentId)
     payload = {
         "deviceId": park_req.deviceId,
         "externalParkingId": park_req.externalParkingId,
     }
-    async with get_service_session(account) as session:
-        async with session.post(url, json=payload) as resp:
-            if resp.status == 200:
-                json_data = await resp.json()
-                logger.debug(
-                    f"/api/v1/rent/park response: {json_data}"
-                )  # Added debug log
-                return {
-                    "message": "Bike parked successfully",
-                    "rentId": park_req.rentId,
-                    "data": json_data,
-                }
-            else:
-                error_data = await resp.json()
-                logger.debug(
-                    f"/api/v1/rent/park error: {error_data}"
-                )  # Added debug log
-                if (
-                    error_data.get("status") == 400
-                    and error_data.get("detail")
-                    == "Wrong rent substatus D0_GET_POSITIONING"
-                ):
-                    raise HTTPException(
-                        status_code=400, detail=error_data.get("detail")
-                    )
-                raise HTTPException(status_code=resp.status, detail=str(error_data))
+    session = await get_service_session(account)
+    async with session.post(url, json=payload) as resp:
+        if resp.status != 200:
+            error_data = await resp.json(loads=orjson.loads)
+            logger.debug("/api/v1/rent/park error: %s", error_data)
+            if (
+                error_data.get("status") == 400
+                and error_data.get("detail")
+                == "Wrong rent substatus D0_GET_POSITIONING"
+            ):
+                raise HTTPException(status_code=400, detail=error_data.get("detail"))
+            raise HTTPException(status_code=resp.status, detail=str(error_data))
+        json_data = await upstream_json(resp, "/api/v1/rent/park")
+    return {
+        "message": "Bike parked successfully",
+        "rentId": park_req.rentId,
+        "data": json_data,
+    }
 
 
 @app.get("/api/v1/rent/status")
@@ -362,20 +485,13 @@ async def check_rent_status(
     Проверяет статус аренды.
     """
     logger.info(f"Check rent status request from {login} for rent {rentId}")
-    account = get_account_by_login(login)
+    account = await get_account_by_login(login)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-    url = f"https://pwa.velobike.ru/api/rent/rents/{rentId}/checkRentStatus?frameNumber={deviceId}"
-    async with get_service_session(account) as session:
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                logger.debug(f"/api/v1/rent/status response: {data}")  # Added debug log
-                return data
-            else:
-                detail = await resp.text()
-                logger.debug(f"/api/v1/rent/status error: {detail}")  # Added debug log
-                raise HTTPException(status_code=resp.status, detail=detail)
+    url = URL_RENT_STATUS(rentId, deviceId)
+    session = await get_service_session(account)
+    async with session.get(url) as resp:
+        return await upstream_json(resp, "/api/v1/rent/status")
 
 
 # Добавляем следующие эндпоинты в файл api.py
@@ -390,30 +506,18 @@ async def finish_rent_after_upload(req: FinishRentRequest):
     Требует: login, rentId, clientGeoPosition.
     """
     logger.info(f"Finish after upload request for rent {req.rentId} by {req.login}")
-    account = get_account_by_login(req.login)
+    account = await get_account_by_login(req.login)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-    url = f"https://pwa.velobike.ru/api/rent/rents/{req.rentId}/finishRentAfterUploadPhoto"
-    async with get_service_session(account) as session:
-        async with session.post(url, json={"login": req.login}) as resp:
-            if resp.status == 200:
-                json_data = await resp.json()
-                logger.debug(
-                    f"/api/v1/rent/finish_after_upload response: {json_data}"
-                )  # Added debug log
-                return json_data
-            elif resp.status == 404:
-                json_data = await resp.json()
-                logger.debug(
-                    f"/api/v1/rent/finish_after_upload error: {json_data}"
-                )  # Added debug log
-                return False
-            else:
-                detail = await resp.text()
-                logger.debug(
-                    f"/api/v1/rent/finish_after_upload error: {detail}"
-                )  # Added debug log
-                raise HTTPException(status_code=resp.status, detail=detail)
+    url = URL_FINISH_AFTER_UPLOAD(req.rentId)
+    session = await get_service_session(account)
+    async with session.post(url, json={"login": req.login}) as resp:
+        if resp.status == 404:
+            logger.debug(
+                "/api/v1/rent/finish_after_upload error: %s", await resp.text()
+            )
+            return False
+        return await upstream_json(resp, "/api/v1/rent/finish_after_upload")
 
 
 # 2. Получение незавершённой поездки (rents_not_finished_user)
@@ -425,27 +529,15 @@ async def rents_not_finished_user(login: str = Query(...)):
     Если поездок нет, возвращает False.
     """
     logger.info(f"Not finished rent request for login {login}")
-    account = get_account_by_login(login)
+    account = await get_account_by_login(login)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-    async with get_service_session(account) as session:
-        async with session.get(
-            "https://pwa.velobike.ru/api/rent/rents/not-finished/user"
-        ) as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                logger.debug(
-                    f"/api/v1/rent/not_finished response: {data}"
-                )  # Added debug log
-                if not data:
-                    return False
-                return data[0]
-            else:
-                detail = await resp.text()
-                logger.debug(
-                    f"/api/v1/rent/not_finished error: {detail}"
-                )  # Added debug log
-                raise HTTPException(status_code=resp.status, detail=detail)
+    session = await get_service_session(account)
+    async with session.get(URL_NOT_FINISHED) as resp:
+        data = await upstream_json(resp, "/api/v1/rent/not_finished")
+    if not data:
+        return False
+    return data[0]
 
 
 # 3. Альтернативный запуск аренды (rent_rents)
@@ -458,7 +550,7 @@ async def rent_rents(req: RentRequest):
     Если API возвращает статус "ERROR_START", выбрасывается ошибка.
     """
     logger.info(f"Rent rents request for bike {req.bikeSerialNumber} by {req.login}")
-    account = get_account_by_login(req.login)
+    account = await get_account_by_login(req.login)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
     payload = {
@@ -466,22 +558,14 @@ async def rent_rents(req: RentRequest):
         "isUsedQr": True,
         "clientGeoPosition": req.clientGeoPosition,
     }
-    async with get_service_session(account) as session:
-        async with session.post(
-            "https://pwa.velobike.ru/api/rent/rents", json=payload
-        ) as resp:
-            data = await resp.json()
-            if resp.status == 200:
-                logger.debug(f"/api/v1/rent/rents response: {data}")  # Added debug log
-                if data.get("status") == "ERROR_START":
-                    if data.get("failedReason") == "ACCOUNT_BLOCKED":
-                        return data
-                    raise HTTPException(status_code=400, detail=str(data))
-                return data
-            else:
-                detail = await resp.text()
-                logger.debug(f"/api/v1/rent/rents error: {detail}")  # Added debug log
-                raise HTTPException(status_code=resp.status, detail=detail)
+    session = await get_service_session(account)
+    async with session.post(URL_RENTS, json=payload) as resp:
+        data = await upstream_json(resp, "/api/v1/rent/rents")
+    if data.get("status") == "ERROR_START":
+        if data.get("failedReason") == "ACCOUNT_BLOCKED":
+            return data
+        raise HTTPException(status_code=400, detail=str(data))
+    return data
 
 
 # ---------------------------
@@ -495,11 +579,20 @@ async def global_exception_handler(request, exc):
 
 class RequestLoggingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request, call_next):
-        logger.debug(
-            f"Incoming request: {request.method} {request.url} Headers: {dict(request.headers)}"
-        )
+        # dict(request.headers) строится только если DEBUG действительно включен
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Incoming request: %s %s Headers: %s",
+                request.method,
+                request.url,
+                dict(request.headers),
+            )
         response = await call_next(request)
         return response
 
 
-app.add_middleware(RequestLoggingMiddleware)
+# Логирование каждого запроса нужно только при отладке
+if logger.isEnabledFor(logging.DEBUG):
+    app.add_middleware(RequestLoggingMiddleware)
+# Сжатие крупных ответов (например, списка велосипедов из /api/v1/search)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
@@ -1,9 +1,13 @@
 import asyncio
+import heapq
+import itertools
 import re
+import time
+from operator import itemgetter
 import aiohttp
 import cv2
 import numpy as np
-from pyzbar.pyzbar import decode
+from pyzbar.pyzbar import decode, ZBarSymbol
 
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command, CommandObject
@@ -18,12 +22,34 @@ from aiogram.filters.callback_data import CallbackData
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from urllib.parse import urlsplit
 
 # Импорт функций работы с БД для Telegram-пользователей и активных поездок
-from database import *
+from database import (
+    get_account_logins,
+    get_telegram_user,
+    create_telegram_user,
+    upsert_telegram_user,
+    update_telegram_user,
+    get_ride,
+    save_ride,
+    delete_ride,
+    bump_stop_step,
+)
 import io
-from config import *
+from config import (
+    BOT_TOKEN,
+    API_BASE_URL,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    logger,
+)
 from enum import Enum
+from cachetools import TTLCache
 
 # ---------------------------
 # Настройка бота и логгирования
@@ -57,6 +83,57 @@ class VeloCallback(CallbackData, prefix="velo"):
     login: str | None = None
 
 
+# ---------------------------
+# Кэш пользователей Telegram
+# ---------------------------
+# Доступ и выбранный логин нужны на каждое сообщение, поэтому хранятся
+# в памяти как (approved, selected_login). Изменения из бота пишутся
+# в кэш сразу, а одобрение администратором подхватывается по истечении TTL.
+# Синхронные запросы к БД выполняются в отдельных потоках через
+# asyncio.to_thread, чтобы не блокировать event loop.
+USER_CACHE: TTLCache = TTLCache(maxsize=10000, ttl=60)
+# Список логинов аккаунтов для /setlogin. Аккаунты меняются администратором
+# вне бота, поэтому кэш обновляется только по истечении TTL.
+ACCOUNT_LOGINS_CACHE: TTLCache = TTLCache(maxsize=1, ttl=60)
+
+
+async def get_cached_user(telegram_id: int) -> tuple[bool, str | None] | None:
+    cached = USER_CACHE.get(telegram_id)
+    if cached is None:
+        user = await asyncio.to_thread(get_telegram_user, telegram_id)
+        if not user:
+            return None
+        cached = USER_CACHE[telegram_id] = (user.approved, user.selected_login)
+    return cached
+
+
+async def load_user(from_user: types.User) -> tuple[bool, str | None] | None:
+    """
+    Загружает пользователя мимо кэша. Если имя в Telegram изменилось,
+    обновляет его в БД одним INSERT ... ON CONFLICT DO UPDATE.
+    """
+    user = await asyncio.to_thread(get_telegram_user, from_user.id)
+    if not user:
+        return None
+    profile = {
+        "username": from_user.username,
+        "first_name": from_user.first_name,
+        "last_name": from_user.last_name,
+    }
+    if any(getattr(user, key) != value for key, value in profile.items()):
+        user = await asyncio.to_thread(upsert_telegram_user, from_user.id, **profile)
+    cached = USER_CACHE[from_user.id] = (user.approved, user.selected_login)
+    return cached
+
+
+async def set_user_login(telegram_id: int, login: str):
+    user = await asyncio.to_thread(
+        update_telegram_user, telegram_id, selected_login=login
+    )
+    if user:
+        USER_CACHE[telegram_id] = (user.approved, user.selected_login)
+
+
 # ---------------------------
 # Middleware для логирования входящих сообщений
 # ---------------------------
@@ -65,30 +142,41 @@ class LoggingMiddleware(BaseMiddleware):
         message = event
 
         # Проверяем, существует ли пользователь в базе данных
-        user = get_telegram_user(message.from_user.id)
+        user = USER_CACHE.get(message.from_user.id)
+        if user is None:
+            user = await load_user(message.from_user)
         if not user:
-            # Если пользователь не найден, добавляем его с настройками по умолчанию
-            create_telegram_user(
+            # Если пользователь не найден, добавляем его с настройками по умолчанию.
+            # Между проверкой и вставкой есть await, поэтому вставка атомарная:
+            # при параллельной регистрации второй вызов вернет None
+            created = await asyncio.to_thread(
+                create_telegram_user,
                 telegram_id=message.from_user.id,
                 username=message.from_user.username,
                 first_name=message.from_user.first_name,
                 last_name=message.from_user.last_name,
                 approved=False,  # По умолчанию доступ запрещен
             )
-            logger.info(
-                f"Новый пользователь добавлен в базу данных: {message.from_user.id} {message.text}"
-            )
-            await message.answer(
-                "🆕 Пользователь добавлен в базу данных. Ожидается подтверждение от администратора."
-            )
-            return
-        else:
-            if not user.approved:
+            if created:
+                USER_CACHE[message.from_user.id] = (False, None)
                 logger.info(
-                    f"Доступ запрещен для пользователя: {message.from_user.id} {message.text}"
+                    f"Новый пользователь добавлен в базу данных: {message.from_user.id} {message.text}"
+                )
+                await message.answer(
+                    "🆕 Пользователь добавлен в базу данных. Ожидается подтверждение от администратора."
                 )
-                await message.answer("❌ Доступ запрещен. Обратитесь к администратору.")
                 return
+            # Пользователя уже создал параллельный запрос: проверяем как обычно
+            user = await load_user(message.from_user)
+            if not user:
+                return
+        approved, _ = user
+        if not approved:
+            logger.info(
+                f"Доступ запрещен для пользователя: {message.from_user.id} {message.text}"
+            )
+            await message.answer("❌ Доступ запрещен. Обратитесь к администратору.")
+            return
         return await handler(event, data)
 
 
@@ -101,17 +189,89 @@ dp.message.middleware(LoggingMiddleware())
 # ---------------------------
 # Вспомогательная функция для вызова API-сервера
 # ---------------------------
+# Одна сессия на все время работы бота: соединения с API-сервером
+# переиспользуются (keep-alive) вместо нового подключения на каждый вызов
+api_session: aiohttp.ClientSession | None = None
+
+
+@dp.startup()
+async def open_api_session():
+    global api_session
+    api_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=100, keepalive_timeout=60, ttl_dns_cache=300
+        )
+    )
+
+
+@dp.shutdown()
+async def close_api_session():
+    if api_session is not None:
+        await api_session.close()
+
+
 async def call_api(method: str, endpoint: str, *, params=None, json=None, data=None):
     url = f"{API_BASE_URL}{endpoint}"
-    async with aiohttp.ClientSession() as session:
-        async with session.request(
-            method, url, params=params, json=json, data=data
-        ) as resp:
-            if resp.status == 200:
-                return await resp.json()
-            else:
-                detail = await resp.text()
-                raise Exception(f"API error {resp.status}: {detail}")
+    async with api_session.request(
+        method, url, params=params, json=json, data=data
+    ) as resp:
+        if resp.status == 200:
+            return await resp.json()
+        else:
+            detail = await resp.text()
+            raise Exception(f"API error {resp.status}: {detail}")
+
+
+# ---------------------------
+# Отложенные задачи
+# ---------------------------
+# Вместо отдельной спящей задачи на каждое отложенное действие все они
+# хранятся в куче (срок, порядковый номер, функция, аргументы), которую
+# разбирает одна фоновая задача. Задача создается только в момент запуска.
+_scheduled: list[tuple[float, int, object, tuple]] = []
+_schedule_seq = itertools.count()
+_schedule_wakeup = asyncio.Event()
+_scheduler_task: asyncio.Task | None = None
+_running_jobs: set[asyncio.Task] = set()
+
+
+def schedule(delay: float, coro_func, *args):
+    """Запускает coro_func(*args) через delay секунд."""
+    heapq.heappush(
+        _scheduled, (time.monotonic() + delay, next(_schedule_seq), coro_func, args)
+    )
+    _schedule_wakeup.set()
+
+
+async def _run_scheduler():
+    while True:
+        _schedule_wakeup.clear()
+        timeout = None
+        now = time.monotonic()
+        while _scheduled and _scheduled[0][0] <= now:
+            _, _, coro_func, args = heapq.heappop(_scheduled)
+            job = asyncio.create_task(coro_func(*args))
+            _running_jobs.add(job)
+            job.add_done_callback(_running_jobs.discard)
+        if _scheduled:
+            timeout = _scheduled[0][0] - now
+        try:
+            # Просыпаемся к ближайшему сроку или при добавлении новой задачи
+            await asyncio.wait_for(_schedule_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+@dp.startup()
+async def start_scheduler():
+    global _scheduler_task
+    _scheduler_task = asyncio.create_task(_run_scheduler())
+
+
+@dp.shutdown()
+async def stop_scheduler():
+    if _scheduler_task is not None:
+        _scheduler_task.cancel()
 
 
 # ---------------------------
@@ -119,7 +279,6 @@ async def call_api(method: str, endpoint: str, *, params=None, json=None, data=N
 # ---------------------------
 async def remove_inline_keyboard(chat_id: int, message_id: int):
     try:
-        await asyncio.sleep(300)  # Ждем 5 минут
         await bot.edit_message_reply_markup(
             chat_id=chat_id, message_id=message_id, reply_markup=None
         )
@@ -151,70 +310,85 @@ def get_ride_keboard(
 # ---------------------------
 # Функция получения выбранного логина из базы
 # ---------------------------
-def get_user_login(chat_id: int) -> str:
-    user = get_telegram_user(chat_id)
-    if not user or not user.selected_login:
+async def get_user_login(chat_id: int) -> str:
+    _, login = await get_cached_user(chat_id) or (False, None)
+    if not login:
         raise Exception("Логин не выбран. Используйте команду /setlogin")
-    return user.selected_login
+    return login
 
 
 # ---------------------------
 # Автоматическое завершение поездки (с повторными попытками)
 # ---------------------------
-async def auto_finish_ride(chat_id: int, rentId):
-    await asyncio.sleep(1 * 60)
-    max_retries = 5
-    delay = 10
-    for attempt in range(1, max_retries + 1):
-        try:
-            await stop_ride_handler(chat_id, rentId)
+AUTO_FINISH_DELAY = 1 * 60
+AUTO_FINISH_RETRIES = 5
+AUTO_FINISH_RETRY_DELAY = 10
+
+
+async def auto_finish_ride(chat_id: int, rentId, attempt: int = 1):
+    # Запускается через планировщик; повторная попытка планируется заново,
+    # а не ждет в спящей задаче
+    try:
+        await stop_ride_handler(chat_id, rentId)
+        await bot.send_message(
+            chat_id,
+            text=f"Поездка {rentId} автоматически завершена",
+        )
+    except Exception as e:
+        logger.error(f"Автозавершение (попытка {attempt}) не удалось: {e}")
+        if attempt < AUTO_FINISH_RETRIES:
+            schedule(
+                AUTO_FINISH_RETRY_DELAY, auto_finish_ride, chat_id, rentId, attempt + 1
+            )
+        else:
             await bot.send_message(
                 chat_id,
-                text=f"Поездка {rentId} автоматически завершена",
+                text=f"Не удалось автоматически завершить поездку {rentId}. Пожалуйста, попробуйте вручную /stop",
             )
-            return
-        except Exception as e:
-            logger.error(f"Автозавершение (попытка {attempt}) не удалось: {e}")
-            if attempt < max_retries:
-                await asyncio.sleep(delay)
-            else:
-                await bot.send_message(
-                    chat_id,
-                    text=f"Не удалось автоматически завершить поездку {rentId}. Пожалуйста, попробуйте вручную /stop",
-                )
-                return
 
 
 # ---------------------------
 # Функция построения inline клавиатуры со всеми velobike аккаунтами
 # ---------------------------
-def get_accounts_keyboard(login: str | None = None) -> InlineKeyboardMarkup:
-    accounts = get_all_accounts()  # Получаем список аккаунтов из базы данных
+async def get_accounts_keyboard(login: str | None = None) -> InlineKeyboardMarkup:
+    logins = ACCOUNT_LOGINS_CACHE.get("logins")
+    if logins is None:
+        logins = await asyncio.to_thread(get_account_logins)
+        ACCOUNT_LOGINS_CACHE["logins"] = logins
     builder = InlineKeyboardBuilder()
-    for account in accounts:
+    for account_login in logins:
         builder.button(
-            text=account.login if account.login != login else f"{account.login} ✅",
-            callback_data=VeloCallback(action=Action.account, login=account.login),
+            text=account_login if account_login != login else f"{account_login} ✅",
+            callback_data=VeloCallback(action=Action.account, login=account_login),
         )
     builder.adjust(2)
     return builder.as_markup()
 
 
-async def countdown_timer(chat_id: int, message_id: int, ride_id: str):
+# События завершения активных поездок по chat_id: обработчик остановки
+# сигналит таймеру обратного отсчета без опроса БД
+RIDE_STOPPED: dict[int, asyncio.Event] = {}
+
+
+def notify_ride_stopped(chat_id: int):
+    stopped = RIDE_STOPPED.pop(chat_id, None)
+    if stopped is not None:
+        stopped.set()
+
+
+async def countdown_timer(
+    chat_id: int, message_id: int, ride_id: str, stopped: asyncio.Event
+):
     """
     Обновляет сообщение с обратным отсчетом от 30 минут до 0.
-    Каждые 30 секунд проверяет, существует ли еще активная поездка.
-    Если поездка отменена, завершаем таймер.
+    Обновление раз в минуту, точнее таймер все равно не показывает.
+    Если поездка завершена (событие stopped), завершаем таймер.
     """
     total_seconds = 29 * 60  # 30 минут в секундах
-    update_interval = 30  # обновляем каждые 30 секунд
+    update_interval = 60  # обновляем каждую минуту
 
     remaining = total_seconds
-    while remaining > 0:
-        # Проверяем, что поездка ещё активна
-        if not get_ride(chat_id):
-            break
-
+    while remaining > 0 and not stopped.is_set():
         minutes, seconds = divmod(remaining, 60)
         ride_keyboard = get_ride_keboard(ride_id, minutes, seconds)
         try:
@@ -225,15 +399,19 @@ async def countdown_timer(chat_id: int, message_id: int, ride_id: str):
             )
         except Exception as ex:
             logger.error(f"Не удалось обновить обратный отсчёт: {ex}")
-        await asyncio.sleep(update_interval)
-        remaining -= update_interval
+        try:
+            await asyncio.wait_for(stopped.wait(), timeout=update_interval)
+        except asyncio.TimeoutError:
+            remaining -= update_interval
+    if RIDE_STOPPED.get(chat_id) is stopped:
+        del RIDE_STOPPED[chat_id]
 
 
 # ---------------------------
 # Универсальный обработчик остановки поездки
 # ---------------------------
 async def stop_ride_handler(chat_id: int, rentId: str | None = None):
-    ride = get_ride(chat_id)
+    ride = await asyncio.to_thread(get_ride, chat_id)
     if not ride:
         raise Exception("Нет активной поездки")
     if rentId and ride.rent_id != rentId:
@@ -255,17 +433,18 @@ async def stop_ride_handler(chat_id: int, rentId: str | None = None):
         "rentId": ride.rent_id,
         "clientGeoPosition": {"lat": 0, "lon": 0},
     }
+    # Какой шаг выполнять, определяет stop_step, прочитанный из БД в начале
     if ride.stop_step == 0:
         # 1. Завершение аренды
         finish_result = await call_api("POST", "/rent/finish", json=finish_payload)
         if finish_result:
-            bump_stop_step(ride.user_id)
+            await asyncio.to_thread(bump_stop_step, ride.user_id)
         logger.debug(finish_result)
     if ride.stop_step == 1:
         # 2. Парковка велосипеда
         park_result = await call_api("POST", "/rent/park", json=park_payload)
         if park_result:
-            bump_stop_step(ride.user_id)
+            await asyncio.to_thread(bump_stop_step, ride.user_id)
         logger.debug(park_result)
     if ride.stop_step == 2:
         # 3. Загрузка фото (используем поддельное изображение)
@@ -287,7 +466,7 @@ async def stop_ride_handler(chat_id: int, rentId: str | None = None):
             "POST", "/rent/upload_photo", params=upload_params, data=form
         )
         if upload_result:
-            bump_stop_step(ride.user_id)
+            await asyncio.to_thread(bump_stop_step, ride.user_id)
         logger.debug(upload_result)
 
     if ride.stop_step == 3:
@@ -296,10 +475,11 @@ async def stop_ride_handler(chat_id: int, rentId: str | None = None):
             "POST", "/rent/finish_after_upload", json=finish_after_payload
         )
         if finish_after_result:
-            bump_stop_step(ride.user_id)
+            await asyncio.to_thread(bump_stop_step, ride.user_id)
         logger.debug(finish_after_result)
     # После успешного выполнения всех шагов – удаляем поездку
-    delete_ride(chat_id)
+    await asyncio.to_thread(delete_ride, chat_id)
+    notify_ride_stopped(chat_id)
     return ride.rent_id
 
 
@@ -310,16 +490,16 @@ async def stop_ride_handler(chat_id: int, rentId: str | None = None):
 @dp.message(Command("setlogin"))
 async def set_login(message: types.Message, command: CommandObject):
     args = command.args
-    user = get_telegram_user(message.from_user.id)
     if not args:
-        keyboard = get_accounts_keyboard(user.selected_login)
+        _, selected_login = await get_cached_user(message.from_user.id)
+        keyboard = await get_accounts_keyboard(selected_login)
         await message.answer(
             text=f"🆔 Выберите логин для аренды:",
             reply_markup=keyboard,
         )
         return
     login = args.strip()
-    update_telegram_user(message.from_user.id, selected_login=login)
+    await set_user_login(message.from_user.id, login)
     await message.answer(text=f"✅ Ваш логин для аренды установлен: <b>{login}</b>")
 
 
@@ -338,7 +518,55 @@ async def cmd_start(message: types.Message, command: CommandObject):
         )
 
 
-@dp.message(F.photo | F.text.regexp(r"\d{5}"))
+# Номер велосипеда: пять цифр подряд (в тексте сообщения или в QR-коде)
+BIKE_CODE_RE = re.compile(r"\d{5}")
+# Для поиска QR-кода достаточно изображения до 1024 пикселей по большей стороне
+QR_MAX_SIDE = 1024
+
+
+def _read_bike_code(img: np.ndarray) -> str | None:
+    decoded_objs = decode(img, symbols=[ZBarSymbol.QRCODE])
+    if decoded_objs:
+        m = BIKE_CODE_RE.search(decoded_objs[0].data.decode())
+        if m:
+            return m.group()
+    return None
+
+
+def _qr_variants(img: np.ndarray):
+    """
+    Варианты изображения для повторных попыток распознавания, от дешевых
+    к дорогим: исходное, инвертированное (светлый код на темном фоне),
+    бинаризация Оцу (блики, низкий контраст) и она же с инверсией,
+    CLAHE и увеличение в 2 раза для мелкого кода. Каждый следующий
+    вариант строится только при неудаче.
+    """
+    yield img
+    yield cv2.bitwise_not(img)
+    yield cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    # Инверсия и бинаризация за один проход OpenCV
+    yield cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    yield cv2.createCLAHE(clipLimit=2.0).apply(img)
+    yield cv2.resize(img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+
+
+def _decode_bike(buf: bytes) -> str | None:
+    """Распознает QR-код на фото и возвращает номер велосипеда."""
+    img = cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    h, w = img.shape
+    scale = min(1, QR_MAX_SIDE / max(h, w))
+    if scale < 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    for variant in _qr_variants(img):
+        bike_code = _read_bike_code(variant)
+        if bike_code:
+            return bike_code
+    return None
+
+
+@dp.message(F.photo | F.text.regexp(BIKE_CODE_RE))
 async def handle_bike_input(message: types.Message):
     chat_id = message.chat.id
     try:
@@ -346,22 +574,21 @@ async def handle_bike_input(message: types.Message):
         if message.photo:
             file_info = await bot.get_file(message.photo[-1].file_id)
             file_bytes = await bot.download_file(file_info.file_path)
-            arr = np.asarray(bytearray(file_bytes.read()), dtype=np.uint8)
-            img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-            decoded_objs = decode(img)
-            if decoded_objs:
-                m = re.search(r"\d{5}", decoded_objs[0].data.decode())
-                if m:
-                    bike_code = m.group()
+            # Распознавание нагружает CPU, поэтому выполняется в отдельном потоке.
+            # getvalue() отдает буфер BytesIO без копирования, а np.frombuffer
+            # внутри _decode_bike читает его напрямую
+            bike_code = (
+                await asyncio.to_thread(_decode_bike, file_bytes.getvalue()) or ""
+            )
         else:
-            m = re.search(r"\d{5}", message.text)
+            m = BIKE_CODE_RE.search(message.text)
             if m:
                 bike_code = m.group()
         if not bike_code:
             await message.answer(text="❌ Не удалось распознать номер велосипеда")
             return
 
-        login = get_user_login(chat_id)
+        login = await get_user_login(chat_id)
         params = {"login": login}
         vehicle_info = await call_api("GET", f"/vehicle/{bike_code}", params=params)
         if vehicle_info.get("operativeStatus") != "STATIONED":
@@ -377,13 +604,15 @@ async def handle_bike_input(message: types.Message):
             callback_data=VeloCallback(action=Action.start, frame=bike_code),
         )
         kb = builder.as_markup()
+        zones = sorted(vehicle_info["zones"], key=itemgetter("id"))
+        zone_names = ", ".join(zone["name"] for zone in zones)
         sent_msg = await message.answer(
-            text=f"{new}<b>Велосипед готов к аренде!</b>\n\n<b>🆔 Информация:</b>\n• Номер рамы: <code>{vehicle_info['frameNumber']}</code>\n• Заряд батареи: 🔋 <b>{vehicle_info['batteryPower']}%</b>\n• Пробег за поездку: <b>{vehicle_info['singleRidingMileage']} км</b>\n\n<b>📍 Текущее местоположение:</b>\n• Адрес парковки: <b>{', '.join([i['name'] for i in sorted(vehicle_info['zones'],key=lambda x:x['id'])])}</b>\n\nНажмите 'СТАРТ' для начала поездки",
+            text=f"{new}<b>Велосипед готов к аренде!</b>\n\n<b>🆔 Информация:</b>\n• Номер рамы: <code>{vehicle_info['frameNumber']}</code>\n• Заряд батареи: 🔋 <b>{vehicle_info['batteryPower']}%</b>\n• Пробег за поездку: <b>{vehicle_info['singleRidingMileage']} км</b>\n\n<b>📍 Текущее местоположение:</b>\n• Адрес парковки: <b>{zone_names}</b>\n\nНажмите 'СТАРТ' для начала поездки",
             reply_markup=kb,
         )
-        # Запускаем задачу на удаление клавиатуры через 5 минут,
+        # Планируем удаление клавиатуры через 5 минут,
         # если она не была удалена до этого (например, после нажатия).
-        asyncio.create_task(remove_inline_keyboard(chat_id, sent_msg.message_id))
+        schedule(300, remove_inline_keyboard, chat_id, sent_msg.message_id)
     except Exception as e:
         logger.error(f"Ошибка при обработке сообщения: {e}")
         await message.answer(text=f"❌ Ошибка:\n{e}")
@@ -397,7 +626,7 @@ async def process_account_selection(
     callback: types.CallbackQuery, callback_data: VeloCallback
 ):
     selected_login = callback_data.login
-    update_telegram_user(callback.message.chat.id, selected_login=selected_login)
+    await set_user_login(callback.message.chat.id, selected_login)
     await callback.message.edit_text(
         text=f"✅ Ваш логин для аренды установлен: {selected_login}"
     )
@@ -416,7 +645,7 @@ async def callback_start_ride(
         await callback.message.edit_text(
             text="⏳ Запускается поездка", reply_markup=None
         )
-        login = get_user_login(chat_id)
+        login = await get_user_login(chat_id)
         payload = {
             "login": login,
             "bikeSerialNumber": bike_code,
@@ -426,7 +655,8 @@ async def callback_start_ride(
         # ride_data = {"rentId": "1", "deviceId": "1", "frameNumber": "1"}
         if ride_data.get("failedReason") == "ACCOUNT_BLOCKED":
             raise Exception("На аккаунте имеются задолженности, или не оплачен тариф")
-        save_ride(
+        await asyncio.to_thread(
+            save_ride,
             chat_id,
             login,
             ride_data["rentId"],
@@ -438,11 +668,14 @@ async def callback_start_ride(
             text=f"🚲 Поездка {ride_data.get('frameNumber', bike_code)} начата\nИспользуйте кнопки ниже для управления:",
             reply_markup=ride_keyboard,
         )
-        # Запускаем задачу автоматического завершения поездки
-        asyncio.create_task(auto_finish_ride(chat_id, ride_data["rentId"]))
+        # Планируем автоматическое завершение поездки
+        schedule(AUTO_FINISH_DELAY, auto_finish_ride, chat_id, ride_data["rentId"])
         # Запускаем задачу обратного отсчёта таймера (30 минут)
+        stopped = RIDE_STOPPED[chat_id] = asyncio.Event()
         asyncio.create_task(
-            countdown_timer(chat_id, callback.message.message_id, ride_data["rentId"])
+            countdown_timer(
+                chat_id, callback.message.message_id, ride_data["rentId"], stopped
+            )
         )
     except Exception as e:
         logger.error(f"Ошибка при запуске поездки: {e}")
@@ -460,7 +693,7 @@ async def callback_open_lock(
     chat_id = callback.message.chat.id
     lock_type = callback_data.action
     try:
-        ride = get_ride(chat_id)
+        ride = await asyncio.to_thread(get_ride, chat_id)
         if not ride:
             await callback.answer(text="Нет активной поездки.", show_alert=True)
             return
@@ -502,8 +735,44 @@ async def stop_ride_handler_unified(event: types.Message | types.CallbackQuery):
 # ---------------------------
 # Запуск бота
 # ---------------------------
+# Допустимый secret_token для Telegram: 1-256 символов A-Z, a-z, 0-9, _ и -
+WEBHOOK_SECRET_RE = re.compile(r"[A-Za-z0-9_-]{1,256}")
+
+
+async def run_webhook():
+    # Доступ проверяется только по from_user.id внутри обновления, поэтому без
+    # секрета любой, кто узнал URL, мог бы прислать поддельное обновление
+    if not WEBHOOK_SECRET_RE.fullmatch(WEBHOOK_SECRET):
+        raise RuntimeError(
+            "Для режима webhook нужен webhook_secret: 1-256 символов A-Z, a-z, 0-9, _ и -"
+        )
+    # Обновления приходят от Telegram на встроенный aiohttp-сервер;
+    # aiogram обрабатывает каждое в отдельной задаче
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(
+        app, path=urlsplit(WEBHOOK_URL).path or "/"
+    )
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT).start()
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        logger.info(f"Webhook запущен: {WEBHOOK_URL}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        # start_polling закрывает сессию бота сам, здесь это нужно сделать явно
+        await bot.session.close()
+
+
 async def main():
-    await dp.start_polling(bot)
+    if WEBHOOK_URL:
+        await run_webhook()
+    else:
+        # Long polling не работает при установленном webhook
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
@@ -14,6 +14,12 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", secrets.get("bot_token", ""))
 API_BASE_URL = secrets.get(
     "api_base_url", "http://localhost:8000/api/v1"
 )  # URL вашего API-сервера
+# Режим webhook: если задан публичный URL, Telegram сам присылает обновления
+# на встроенный HTTP-сервер бота; иначе бот работает через long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", secrets.get("webhook_url", ""))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", secrets.get("webhook_secret", ""))
+WEBHOOK_HOST = secrets.get("webhook_host", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", secrets.get("webhook_port", 8080)))
 logging.basicConfig(
     level=LOG_LEVEL,
     format="%(asctime)s [%(levelname)s] %(message)s",
@@ -28,7 +34,7 @@ DATABASE_URL = os.getenv("DATABASE_URL", secrets.get("database_url", ""))
 # Глобальные заголовки для запросов к сервису
 HEADERS = {
     "Accept": "application/json, text/plain, */*",
-    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "Accept-Encoding": "gzip, deflate, br",
     "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7,zh-CN;q=0.6,zh;q=0.5",
     "app-version": "1.55.108",
     "Connection": "keep-alive",
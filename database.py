@@ -1,15 +1,46 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean
-from sqlalchemy.orm import declarative_base, sessionmaker, Session
+from sqlalchemy import (
+    create_engine,
+    bindparam,
+    select,
+    update,
+    delete,
+    func,
+    Column,
+    Integer,
+    BigInteger,
+    String,
+    DateTime,
+    Boolean,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session, Session
 from config import *
-from typing import Optional, List
-import datetime
-
-# Создаем движок для подключения к БД
-engine = create_engine(DATABASE_URL)
+from typing import Optional, List, Dict, Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# Создаем движок для подключения к БД с пулом соединений
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=20,
+    max_overflow=40,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    # Сначала выдаются недавно использованные (уже прогретые) соединения,
+    # а лишние при низкой нагрузке остаются в простое
+    pool_use_lifo=True,
+    pool_recycle=1800,
+)
+# INSERT ... ON CONFLICT есть только в диалектах PostgreSQL и SQLite
+_upsert_insert = sqlite_insert if engine.dialect.name == "sqlite" else pg_insert
 # Единая база для всех моделей
 Base = declarative_base()
-# Фабрика сессий
-SessionLocal = sessionmaker(bind=engine)
+# Фабрика сессий. Объекты не сбрасываются после commit, поэтому
+# их можно читать и после закрытия сессии
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+# Потокобезопасный реестр сессий для горячих путей (API)
+ScopedSession = scoped_session(SessionLocal)
 
 
 # ================================
@@ -18,14 +49,14 @@ SessionLocal = sessionmaker(bind=engine)
 class Account(Base):
     __tablename__ = "accounts"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    login = Column(String, nullable=False)
+    login = Column(String, nullable=False, unique=True, index=True)
     password = Column(String, nullable=False)
     cookie = Column(String, nullable=False)
     token = Column(String, nullable=True)  # Новый столбец token
     updated_at = Column(
         DateTime,
-        default=datetime.datetime.now(datetime.timezone.utc),
-        onupdate=datetime.datetime.now(datetime.timezone.utc),
+        default=func.now(),
+        onupdate=func.now(),
     )
 
     def __repr__(self):
@@ -38,29 +69,42 @@ class Account(Base):
 class ActiveRide(Base):
     __tablename__ = "active_rides"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, nullable=False, unique=True)  # Telegram ID пользователя
+    # Telegram ID пользователя
+    user_id = Column(BigInteger, nullable=False, unique=True)
     login = Column(String, nullable=False)  # Логин для API Velobike
     rent_id = Column(String, nullable=False)  # ID аренды, полученный от API
     device_id = Column(String, nullable=False)  # ID устройства (велосипеда)
     frame_number = Column(String, nullable=False)  # Номер велосипеда
     stop_step = Column(Integer, default=0)  # Новый столбец stop_step
-    start_time = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc))
+    start_time = Column(DateTime, default=func.now())
     updated_at = Column(
         DateTime,
-        default=datetime.datetime.now(datetime.timezone.utc),
-        onupdate=datetime.datetime.now(datetime.timezone.utc),
+        default=func.now(),
+        onupdate=func.now(),
     )
 
     def __repr__(self):
         return f"<ActiveRide(user_id={self.user_id}, rent_id={self.rent_id}, frame_number={self.frame_number}, stop_step={self.stop_step})>"
 
 
+@dataclass(frozen=True, slots=True)
+class Ride:
+    """Данные активной поездки для обработчиков бота."""
+
+    user_id: int
+    login: str
+    rent_id: str
+    device_id: str
+    stop_step: int
+
+
 # ============================================
 # Модель для таблицы telegram_users (бот)
 # ============================================
 class TelegramUser(Base):
     __tablename__ = "telegram_users"
-    telegram_id = Column(Integer, primary_key=True)  # Telegram ID пользователя
+    # Telegram ID пользователя (может не помещаться в 32 бита)
+    telegram_id = Column(BigInteger, primary_key=True)
     selected_login = Column(String, nullable=True)  # Выбранный логин сервиса аренды
     approved = Column(
         Boolean, nullable=False, default=False
@@ -70,16 +114,21 @@ class TelegramUser(Base):
         Integer, default=0, nullable=False
     )  # Общее время поездок (в секундах)
     last_ride_date = Column(DateTime, nullable=True)  # Дата последней поездки
+    # Дату регистрации вычисляет БД. default (now() в самом INSERT) оставлен
+    # для таблиц, созданных раньше и не имеющих DEFAULT у колонки.
     registration_date = Column(
-        DateTime, default=datetime.datetime.now(datetime.timezone.utc), nullable=False
+        DateTime(timezone=True),
+        default=func.now(),
+        server_default=func.now(),
+        nullable=False,
     )
     username = Column(String, nullable=True)  # Telegram username
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
     updated_at = Column(
         DateTime,
-        default=datetime.datetime.now(datetime.timezone.utc),
-        onupdate=datetime.datetime.now(datetime.timezone.utc),
+        default=func.now(),
+        onupdate=func.now(),
     )
 
     def __repr__(self):
@@ -103,192 +152,281 @@ def get_session() -> Session:
     return SessionLocal()
 
 
-# ============================================
-# Функции для работы с таблицей Account
-# ============================================
-def get_account_by_login(login: str) -> Optional[Account]:
-    session = get_session()
-    try:
-        account = session.query(Account).filter(Account.login == login).first()
-        if account is None:
-            logger.info(f"Аккаунт с логином '{login}' не найден.")
-        return account
-    except Exception as e:
-        logger.error(f"Ошибка при выборке аккаунта '{login}': {e}")
-        raise e
-    finally:
-        session.close()
-
-
-def create_account(
-    login: str, password: str, cookie: str, token: Optional[str] = None
-) -> Account:
+@contextmanager
+def session_scope(session: Optional[Session] = None) -> Iterator[Session]:
+    """
+    Отдает переданную сессию или открывает новую. Своей сессией управляет
+    сам: фиксирует транзакцию, откатывает ее при ошибке и закрывает.
+    Переданную сессию при ошибке откатывает, а фиксирует и закрывает ее
+    вызывающий код. Функции ниже сами commit не вызывают.
+    """
+    if session is not None:
+        try:
+            yield session
+        except Exception:
+            session.rollback()
+            raise
+        return
     session = get_session()
     try:
-        account = Account(login=login, password=password, cookie=cookie, token=token)
-        session.add(account)
+        yield session
         session.commit()
-        session.refresh(account)
-        logger.info(f"Аккаунт '{login}' успешно создан.")
-        return account
-    except Exception as e:
+    except Exception:
         session.rollback()
-        logger.error(f"Ошибка при создании аккаунта '{login}': {e}")
-        raise e
+        raise
     finally:
         session.close()
 
 
-def update_account(
-    login: str, cookie: Optional[str] = None, token: Optional[str] = None
+# ============================================
+# Функции для работы с таблицей Account
+# ============================================
+def get_account_by_login(
+    login: str, session: Optional[Session] = None
 ) -> Optional[Account]:
-    session = get_session()
-    try:
-        account = session.query(Account).filter(Account.login == login).first()
-        if not account:
-            logger.info(f"Аккаунт с логином '{login}' не найден для обновления.")
-            return None
-        if cookie is not None:
-            account.cookie = cookie
-        if token is not None:
-            account.token = token
-        session.commit()
-        session.refresh(account)
-        logger.info(f"Аккаунт '{login}' успешно обновлен.")
-        return account
-    except Exception as e:
-        session.rollback()
-        logger.error(f"Ошибка при обновлении аккаунта '{login}': {e}")
-        raise e
-    finally:
-        session.close()
+    with session_scope(session) as session:
+        try:
+            account = session.query(Account).filter(Account.login == login).first()
+            if account is None:
+                logger.info("Аккаунт с логином '%s' не найден.", login)
+            return account
+        except Exception as e:
+            logger.error("Ошибка при выборке аккаунта '%s': %s", login, e)
+            raise e
+
+
+def get_accounts_by_logins(
+    logins: Iterable[str], session: Optional[Session] = None
+) -> Dict[str, Account]:
+    """Возвращает аккаунты по списку логинов одним запросом."""
+    with session_scope(session) as session:
+        try:
+            accounts = (
+                session.query(Account).filter(Account.login.in_(list(logins))).all()
+            )
+            return {account.login: account for account in accounts}
+        except Exception as e:
+            logger.error("Ошибка при выборке аккаунтов по логинам: %s", e)
+            raise e
 
 
-def delete_account(login: str) -> bool:
-    session = get_session()
-    try:
-        account = session.query(Account).filter(Account.login == login).first()
-        if not account:
-            logger.info(f"Аккаунт с логином '{login}' не найден для удаления.")
-            return False
-        session.delete(account)
-        session.commit()
-        logger.info(f"Аккаунт '{login}' успешно удален.")
-        return True
-    except Exception as e:
-        session.rollback()
-        logger.error(f"Ошибка при удалении аккаунта '{login}': {e}")
-        raise e
-    finally:
-        session.close()
+def create_account(
+    login: str,
+    password: str,
+    cookie: str,
+    token: Optional[str] = None,
+    session: Optional[Session] = None,
+) -> Account:
+    with session_scope(session) as session:
+        try:
+            account = Account(
+                login=login, password=password, cookie=cookie, token=token
+            )
+            session.add(account)
+            # Ошибки INSERT (например, занятый логин) всплывают здесь, а не при commit
+            session.flush()
+            logger.info("Аккаунт '%s' успешно создан.", login)
+            return account
+        except Exception as e:
+            logger.error("Ошибка при создании аккаунта '%s': %s", login, e)
+            raise e
 
 
-def get_all_accounts() -> List[Account]:
-    session = get_session()
-    try:
-        accounts = session.query(Account).all()
-        return accounts
-    except Exception as e:
-        logger.error(f"Ошибка при получении списка аккаунтов: {e}")
-        raise e
-    finally:
-        session.close()
+def update_account(
+    login: str,
+    cookie: Optional[str] = None,
+    token: Optional[str] = None,
+    session: Optional[Session] = None,
+) -> Optional[Account]:
+    with session_scope(session) as session:
+        try:
+            values = {}
+            if cookie is not None:
+                values["cookie"] = cookie
+            if token is not None:
+                values["token"] = token
+            if not values:
+                return session.query(Account).filter(Account.login == login).first()
+            # UPDATE ... RETURNING отдает строку вместе с новым updated_at
+            account = session.execute(
+                update(Account)
+                .where(Account.login == login)
+                .values(**values)
+                .returning(Account)
+                .execution_options(synchronize_session=False)
+            ).scalar_one_or_none()
+            if not account:
+                logger.info("Аккаунт с логином '%s' не найден для обновления.", login)
+                return None
+            logger.info("Аккаунт '%s' успешно обновлен.", login)
+            return account
+        except Exception as e:
+            logger.error("Ошибка при обновлении аккаунта '%s': %s", login, e)
+            raise e
+
+
+def update_accounts_bulk(
+    updates: List[Dict[str, str]], session: Optional[Session] = None
+) -> int:
+    """
+    Обновляет cookie и token нескольких аккаунтов одним executemany
+    в одной транзакции. Элементы: {"l": логин, "c": cookie, "t": token}.
+    Возвращает число обновленных строк.
+    """
+    if not updates:
+        return 0
+    table = Account.__table__
+    stmt = (
+        update(table)
+        .where(table.c.login == bindparam("l"))
+        .values(cookie=bindparam("c"), token=bindparam("t"))
+    )
+    with session_scope(session) as session:
+        try:
+            result = session.connection().execute(stmt, updates)
+            logger.info("Обновлено аккаунтов: %s", result.rowcount)
+            return result.rowcount
+        except Exception as e:
+            logger.error("Ошибка при пакетном обновлении аккаунтов: %s", e)
+            raise e
+
+
+def delete_account(login: str, session: Optional[Session] = None) -> bool:
+    with session_scope(session) as session:
+        try:
+            account = session.query(Account).filter(Account.login == login).first()
+            if not account:
+                logger.info("Аккаунт с логином '%s' не найден для удаления.", login)
+                return False
+            session.delete(account)
+            session.flush()
+            logger.info("Аккаунт '%s' успешно удален.", login)
+            return True
+        except Exception as e:
+            logger.error("Ошибка при удалении аккаунта '%s': %s", login, e)
+            raise e
+
+
+def get_all_accounts(session: Optional[Session] = None) -> List[Account]:
+    with session_scope(session) as session:
+        try:
+            accounts = session.query(Account).all()
+            return accounts
+        except Exception as e:
+            logger.error("Ошибка при получении списка аккаунтов: %s", e)
+            raise e
+
+
+def get_account_logins(session: Optional[Session] = None) -> List[str]:
+    """Возвращает логины всех аккаунтов без загрузки ORM-объектов."""
+    with session_scope(session) as session:
+        try:
+            return list(session.execute(select(Account.login)).scalars())
+        except Exception as e:
+            logger.error("Ошибка при получении списка логинов: %s", e)
+            raise e
 
 
 # ============================================
 # Функции для работы с таблицей ActiveRide
 # ============================================
 def save_ride(
-    user_id: int, login: str, rent_id: str, device_id: str, frame_number: str
+    user_id: int,
+    login: str,
+    rent_id: str,
+    device_id: str,
+    frame_number: str,
+    session: Optional[Session] = None,
 ) -> ActiveRide:
-    session = get_session()
-    try:
-        ride = ActiveRide(
-            user_id=user_id,
-            login=login,
-            rent_id=rent_id,
-            device_id=device_id,
-            frame_number=frame_number,
-        )
-        session.add(ride)
-        session.commit()
-        session.refresh(ride)
-        logger.info(f"Активная поездка для user_id {user_id} сохранена: {ride}")
-        return ride
-    except Exception as e:
-        session.rollback()
-        logger.error(f"Ошибка сохранения поездки для user_id {user_id}: {e}")
-        raise e
-    finally:
-        session.close()
-
-
-def get_ride(user_id: int) -> Optional[ActiveRide]:
-    session = get_session()
-    try:
-        ride = session.query(ActiveRide).filter(ActiveRide.user_id == user_id).first()
-        return ride
-    except Exception as e:
-        logger.error(f"Ошибка при получении поездки для user_id {user_id}: {e}")
-        raise e
-    finally:
-        session.close()
-
-
-def delete_ride(user_id: int) -> bool:
-    session = get_session()
-    try:
-        ride = session.query(ActiveRide).filter(ActiveRide.user_id == user_id).first()
-        if not ride:
-            logger.info(
-                f"Активная поездка для user_id {user_id} не найдена для удаления."
+    with session_scope(session) as session:
+        try:
+            ride = ActiveRide(
+                user_id=user_id,
+                login=login,
+                rent_id=rent_id,
+                device_id=device_id,
+                frame_number=frame_number,
             )
-            return False
-        session.delete(ride)
-        session.commit()
-        logger.info(f"Активная поездка для user_id {user_id} успешно удалена.")
-        return True
-    except Exception as e:
-        session.rollback()
-        logger.error(f"Ошибка при удалении поездки для user_id {user_id}: {e}")
-        raise e
-    finally:
-        session.close()
-
-
-def get_all_rides() -> List[ActiveRide]:
-    session = get_session()
-    try:
-        rides = session.query(ActiveRide).all()
-        return rides
-    except Exception as e:
-        logger.error(f"Ошибка при получении списка активных поездок: {e}")
-        raise e
-    finally:
-        session.close()
-
-
-def bump_stop_step(user_id: int) -> Optional[ActiveRide]:
-    """Получает активную поездку по user_id, увеличивает stop_step на 1 и сохраняет изменения."""
-    session = get_session()
-    try:
-        ride = session.query(ActiveRide).filter(ActiveRide.user_id == user_id).first()
-        if not ride:
-            logger.info(
-                f"Активная поездка для user_id {user_id} не найдена для bump_stop_step."
+            session.add(ride)
+            # Ошибки INSERT (например, вторая поездка) всплывают здесь, а не при commit
+            session.flush()
+            logger.debug("Активная поездка для user_id %s сохранена: %s", user_id, ride)
+            return ride
+        except Exception as e:
+            logger.error("Ошибка сохранения поездки для user_id %s: %s", user_id, e)
+            raise e
+
+
+def get_ride(user_id: int, session: Optional[Session] = None) -> Optional[Ride]:
+    """Возвращает поля активной поездки, нужные боту, без загрузки ORM-объекта."""
+    with session_scope(session) as session:
+        try:
+            row = session.execute(
+                select(
+                    ActiveRide.user_id,
+                    ActiveRide.login,
+                    ActiveRide.rent_id,
+                    ActiveRide.device_id,
+                    ActiveRide.stop_step,
+                ).where(ActiveRide.user_id == user_id)
+            ).first()
+            return Ride(*row) if row else None
+        except Exception as e:
+            logger.error("Ошибка при получении поездки для user_id %s: %s", user_id, e)
+            raise e
+
+
+def delete_ride(user_id: int, session: Optional[Session] = None) -> bool:
+    """Удаляет активную поездку одним DELETE, без предварительной выборки."""
+    with session_scope(session) as session:
+        try:
+            result = session.execute(
+                delete(ActiveRide).where(ActiveRide.user_id == user_id)
             )
-            return None
-        ride.stop_step += 1
-        session.commit()
-        session.refresh(ride)
-        logger.info(f"stop_step для user_id {user_id} увеличен до {ride.stop_step}.")
-        return ride
-    except Exception as e:
-        session.rollback()
-        logger.error(f"Ошибка при bump_stop_step для user_id {user_id}: {e}")
-        raise e
-    finally:
-        session.close()
+            if not result.rowcount:
+                logger.info(
+                    "Активная поездка для user_id %s не найдена для удаления.", user_id
+                )
+                return False
+            logger.debug("Активная поездка для user_id %s успешно удалена.", user_id)
+            return True
+        except Exception as e:
+            logger.error("Ошибка при удалении поездки для user_id %s: %s", user_id, e)
+            raise e
+
+
+def get_all_rides(session: Optional[Session] = None) -> List[ActiveRide]:
+    with session_scope(session) as session:
+        try:
+            rides = session.query(ActiveRide).all()
+            return rides
+        except Exception as e:
+            logger.error("Ошибка при получении списка активных поездок: %s", e)
+            raise e
+
+
+def bump_stop_step(user_id: int, session: Optional[Session] = None) -> Optional[int]:
+    """Увеличивает stop_step активной поездки на 1 одним UPDATE и возвращает новое значение."""
+    with session_scope(session) as session:
+        try:
+            stmt = (
+                update(ActiveRide)
+                .where(ActiveRide.user_id == user_id)
+                .values(stop_step=ActiveRide.stop_step + 1)
+                .returning(ActiveRide.stop_step)
+            )
+            stop_step = session.execute(stmt).scalar_one_or_none()
+            if stop_step is None:
+                logger.info(
+                    "Активная поездка для user_id %s не найдена для bump_stop_step.",
+                    user_id,
+                )
+                return None
+            logger.debug("stop_step для user_id %s увеличен до %s.", user_id, stop_step)
+            return stop_step
+        except Exception as e:
+            logger.error("Ошибка при bump_stop_step для user_id %s: %s", user_id, e)
+            raise e
 
 
 # ============================================
@@ -301,129 +439,194 @@ def create_telegram_user(
     username: Optional[str] = None,
     first_name: Optional[str] = None,
     last_name: Optional[str] = None,
-) -> TelegramUser:
-    session = get_session()
-    try:
-        user = TelegramUser(
-            telegram_id=telegram_id,
-            selected_login=selected_login,
-            approved=approved,
-            username=username,
-            first_name=first_name,
-            last_name=last_name,
-            registration_date=datetime.datetime.now(datetime.timezone.utc),
-        )
-        session.add(user)
-        session.commit()
-        session.refresh(user)
-        logger.info(f"TelegramUser {telegram_id} успешно создан: {user}")
-        return user
-    except Exception as e:
-        session.rollback()
-        logger.error(f"Ошибка при создании TelegramUser {telegram_id}: {e}")
-        raise e
-    finally:
-        session.close()
+    session: Optional[Session] = None,
+) -> Optional[TelegramUser]:
+    """
+    Создает пользователя одним INSERT ... ON CONFLICT DO NOTHING ... RETURNING.
+    Возвращает None, если пользователь уже существует (например, его только
+    что создал параллельный запрос), вместо ошибки первичного ключа.
+    """
+    with session_scope(session) as session:
+        try:
+            # RETURNING сразу отдает строку с серверными значениями
+            stmt = (
+                _upsert_insert(TelegramUser)
+                .values(
+                    telegram_id=telegram_id,
+                    selected_login=selected_login,
+                    approved=approved,
+                    username=username,
+                    first_name=first_name,
+                    last_name=last_name,
+                )
+                .on_conflict_do_nothing(index_elements=[TelegramUser.telegram_id])
+                .returning(TelegramUser)
+            )
+            user = session.execute(stmt).scalar_one_or_none()
+            if user is None:
+                logger.info("TelegramUser %s уже существует.", telegram_id)
+                return None
+            logger.debug("TelegramUser %s успешно создан: %s", telegram_id, user)
+            return user
+        except Exception as e:
+            logger.error("Ошибка при создании TelegramUser %s: %s", telegram_id, e)
+            raise e
 
 
-def get_telegram_user(telegram_id: int) -> Optional[TelegramUser]:
-    session = get_session()
-    try:
-        user = (
-            session.query(TelegramUser)
-            .filter(TelegramUser.telegram_id == telegram_id)
-            .first()
-        )
-        return user
-    except Exception as e:
-        logger.error(f"Ошибка при получении TelegramUser {telegram_id}: {e}")
-        raise e
-    finally:
-        session.close()
+# Колонки TelegramUser, которые можно передать в upsert_telegram_user
+UPSERT_FIELDS = frozenset(
+    {"selected_login", "approved", "username", "first_name", "last_name"}
+)
 
 
-def update_telegram_user(
-    telegram_id: int,
-    selected_login: Optional[str] = None,
-    approved: Optional[bool] = None,
-    username: Optional[str] = None,
-    first_name: Optional[str] = None,
-    last_name: Optional[str] = None,
-    rides_count: Optional[int] = None,
-    total_ride_duration: Optional[int] = None,
-    last_ride_date: Optional[datetime.datetime] = None,
+def upsert_telegram_user(
+    telegram_id: int, session: Optional[Session] = None, **fields
+) -> TelegramUser:
+    """
+    Создает пользователя или обновляет переданные поля существующего
+    одним INSERT ... ON CONFLICT DO UPDATE ... RETURNING, без гонки
+    между проверкой существования и вставкой.
+    """
+    unknown = fields.keys() - UPSERT_FIELDS
+    if unknown:
+        raise ValueError(f"Недопустимые поля TelegramUser: {sorted(unknown)}")
+    with session_scope(session) as session:
+        try:
+            stmt = _upsert_insert(TelegramUser).values(
+                telegram_id=telegram_id, **fields
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[TelegramUser.telegram_id],
+                # onupdate для ON CONFLICT не срабатывает, updated_at задаем явно
+                set_={
+                    **{key: stmt.excluded[key] for key in fields},
+                    "updated_at": func.now(),
+                },
+            ).returning(TelegramUser)
+            user = session.execute(stmt).scalar_one()
+            logger.debug("TelegramUser %s сохранен: %s", telegram_id, user)
+            return user
+        except Exception as e:
+            logger.error("Ошибка при сохранении TelegramUser %s: %s", telegram_id, e)
+            raise e
+
+
+def get_telegram_user(
+    telegram_id: int, session: Optional[Session] = None
 ) -> Optional[TelegramUser]:
-    session = get_session()
-    try:
-        user = (
-            session.query(TelegramUser)
-            .filter(TelegramUser.telegram_id == telegram_id)
-            .first()
-        )
-        if not user:
-            logger.info(f"TelegramUser {telegram_id} не найден для обновления.")
-            return None
-        if selected_login is not None:
-            user.selected_login = selected_login
-        if approved is not None:
-            user.approved = approved
-        if username is not None:
-            user.username = username
-        if first_name is not None:
-            user.first_name = first_name
-        if last_name is not None:
-            user.last_name = last_name
-        if rides_count is not None:
-            user.rides_count = rides_count
-        if total_ride_duration is not None:
-            user.total_ride_duration = total_ride_duration
-        if last_ride_date is not None:
-            user.last_ride_date = last_ride_date
-        session.commit()
-        session.refresh(user)
-        logger.info(f"TelegramUser {telegram_id} успешно обновлен: {user}")
-        return user
-    except Exception as e:
-        session.rollback()
-        logger.error(f"Ошибка при обновлении TelegramUser {telegram_id}: {e}")
-        raise e
-    finally:
-        session.close()
-
+    with session_scope(session) as session:
+        try:
+            # Поиск по первичному ключу; повторное чтение в той же сессии
+            # берется из identity map без запроса
+            return session.get(TelegramUser, telegram_id)
+        except Exception as e:
+            logger.error("Ошибка при получении TelegramUser %s: %s", telegram_id, e)
+            raise e
+
+
+# Размер списка IN в одном запросе
+BULK_CHUNK_SIZE = 1000
+
+
+def get_telegram_users_bulk(
+    telegram_ids: Iterable[int], session: Optional[Session] = None
+) -> Dict[int, TelegramUser]:
+    """Возвращает TelegramUser по списку ID одним запросом на каждые 1000 ID."""
+    ids = list(dict.fromkeys(telegram_ids))
+    users: Dict[int, TelegramUser] = {}
+    with session_scope(session) as session:
+        try:
+            for start in range(0, len(ids), BULK_CHUNK_SIZE):
+                chunk = ids[start : start + BULK_CHUNK_SIZE]
+                for user in session.scalars(
+                    select(TelegramUser).where(TelegramUser.telegram_id.in_(chunk))
+                ):
+                    users[user.telegram_id] = user
+            return users
+        except Exception as e:
+            logger.error("Ошибка при выборке TelegramUser по списку ID: %s", e)
+            raise e
+
+
+# Колонки TelegramUser, которые можно передать в update_telegram_user
+UPDATE_FIELDS = UPSERT_FIELDS | {"rides_count", "total_ride_duration", "last_ride_date"}
 
-def delete_telegram_user(telegram_id: int) -> bool:
-    session = get_session()
-    try:
-        user = (
-            session.query(TelegramUser)
-            .filter(TelegramUser.telegram_id == telegram_id)
-            .first()
-        )
-        if not user:
-            logger.info(f"TelegramUser {telegram_id} не найден для удаления.")
-            return False
-        session.delete(user)
-        session.commit()
-        logger.info(f"TelegramUser {telegram_id} успешно удален.")
-        return True
-    except Exception as e:
-        session.rollback()
-        logger.error(f"Ошибка при удалении TelegramUser {telegram_id}: {e}")
-        raise e
-    finally:
-        session.close()
 
-
-def get_all_telegram_users() -> List[TelegramUser]:
-    session = get_session()
-    try:
-        users = session.query(TelegramUser).all()
-        return users
-    except Exception as e:
-        logger.error(f"Ошибка при получении списка TelegramUser: {e}")
-        raise e
-    finally:
-        session.close()
+def update_telegram_user(
+    telegram_id: int, session: Optional[Session] = None, **fields
+) -> Optional[TelegramUser]:
+    """
+    Обновляет переданные поля пользователя. Поля со значением None
+    не изменяются.
+    """
+    unknown = fields.keys() - UPDATE_FIELDS
+    if unknown:
+        raise ValueError(f"Недопустимые поля TelegramUser: {sorted(unknown)}")
+    values = {key: value for key, value in fields.items() if value is not None}
+    with session_scope(session) as session:
+        try:
+            if not values:
+                return get_telegram_user(telegram_id, session=session)
+            # Один UPDATE ... RETURNING вместо выборки, изменения и перечитывания
+            stmt = (
+                update(TelegramUser)
+                .where(TelegramUser.telegram_id == telegram_id)
+                .values(**values)
+                .returning(TelegramUser)
+                .execution_options(synchronize_session=False)
+            )
+            user = session.execute(stmt).scalar_one_or_none()
+            if not user:
+                logger.info("TelegramUser %s не найден для обновления.", telegram_id)
+                return None
+            logger.debug("TelegramUser %s успешно обновлен: %s", telegram_id, user)
+            return user
+        except Exception as e:
+            logger.error("Ошибка при обновлении TelegramUser %s: %s", telegram_id, e)
+            raise e
+
+
+def delete_telegram_user(telegram_id: int, session: Optional[Session] = None) -> bool:
+    with session_scope(session) as session:
+        try:
+            deleted_id = session.execute(
+                delete(TelegramUser)
+                .where(TelegramUser.telegram_id == telegram_id)
+                .returning(TelegramUser.telegram_id)
+            ).scalar_one_or_none()
+            if deleted_id is None:
+                logger.info("TelegramUser %s не найден для удаления.", telegram_id)
+                return False
+            logger.debug("TelegramUser %s успешно удален.", telegram_id)
+            return True
+        except Exception as e:
+            logger.error("Ошибка при удалении TelegramUser %s: %s", telegram_id, e)
+            raise e
+
+
+def get_all_telegram_users(session: Optional[Session] = None) -> List[TelegramUser]:
+    with session_scope(session) as session:
+        try:
+            users = session.query(TelegramUser).all()
+            return users
+        except Exception as e:
+            logger.error("Ошибка при получении списка TelegramUser: %s", e)
+            raise e
+
+
+def iter_telegram_users(batch_size: int = 1000) -> Iterator[TelegramUser]:
+    """
+    Перебирает всех TelegramUser порциями по batch_size строк, не загружая
+    таблицу в память целиком. Сессия открыта, пока перебор не закончится.
+    """
+    with session_scope() as session:
+        try:
+            yield from session.scalars(
+                select(TelegramUser).execution_options(yield_per=batch_size)
+            )
+        except Exception as e:
+            logger.error("Ошибка при переборе TelegramUser: %s", e)
+            raise e
 
 
 # Точка входа для самостоятельного запуска скрипта (например, для создания таблиц)
@@ -1,54 +1,130 @@
+import asyncio
+import sys
 import time
+from http.cookiejar import DefaultCookiePolicy
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # patchright here!
-from patchright.sync_api import sync_playwright
+from patchright.async_api import async_playwright
 from config import HEADERS
-from database import get_all_accounts, update_account, logger
+from database import get_all_accounts, update_accounts_bulk, logger
+
+# Сколько аккаунтов обновляется одновременно
+REFRESH_CONCURRENCY = 4
+
+
+class _NoStoreCookiePolicy(DefaultCookiePolicy):
+    """Не сохраняет cookie из ответов: у каждого аккаунта свой qrator_jsid."""
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+# Одна HTTP-сессия на все аккаунты: TCP/TLS-соединения с сервисом
+# переиспользуются. Повторяются только ошибки соединения, POST повторно
+# не отправляется.
+SESSION = requests.Session()
+SESSION.cookies.set_policy(_NoStoreCookiePolicy())
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=REFRESH_CONCURRENCY,
+        max_retries=Retry(total=3, backoff_factor=0.3),
+    ),
+)
+# Таймауты (подключение, чтение) в секундах
+AUTH_TIMEOUT = (3, 10)
+
+
+VELOBIKE_URL = "https://pwa.velobike.ru/"
+
+# Интервал опроса cookie после загрузки страницы, в секундах
+COOKIE_POLL_INTERVAL = 0.1
+
+# Страница открывается только ради cookie qrator_jsid: картинки, шрифты,
+# видео и стили не нужны. Скрипты не блокируются — cookie ставит JS qrator.
+BLOCKED_RESOURCES = frozenset({"image", "media", "font", "stylesheet"})
+
+
+async def block_resources(route):
+    if route.request.resource_type in BLOCKED_RESOURCES:
+        await route.abort()
+    else:
+        await route.continue_()
 
 
-def wait_for_page_load(page, timeout=20000):
+async def wait_for_page_load(page, timeout=20000):
     """
     Ждет полной загрузки страницы, используя метод wait_for_load_state.
-    Дополнительная задержка учитывает редиректы.
+    Редиректы после загрузки учитывает ожидание cookie в get_qrator_cookie.
     """
     try:
-        page.wait_for_load_state("load", timeout=timeout)
-        time.sleep(2)
+        await page.wait_for_load_state("load", timeout=timeout)
         return True
     except Exception as e:
         logger.error(f"Ошибка ожидания загрузки страницы: {e}")
         return False
 
 
-def get_qrator_cookie(page):
+async def get_qrator_cookie(page, timeout=5000):
     """
-    Извлекает cookie с именем 'qrator_jsid' из Playwright.
+    Извлекает cookie с именем 'qrator_jsid' из Playwright (словарь с полями
+    value, expires и т.д.).
+    Cookie может появиться уже после события load (редиректы qrator), поэтому
+    хранилище контекста опрашивается до появления cookie или истечения timeout.
+    Опрашивается именно контекст, а не document.cookie: cookie может быть HttpOnly.
     """
-    cookies = page.context.cookies()
-    for cookie in cookies:
-        if cookie["name"] == "qrator_jsid":
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout / 1000
+    while True:
+        # Запрашиваем только cookie сайта, а не все хранилище контекста
+        cookies = await page.context.cookies(urls=[VELOBIKE_URL])
+        cookie = next((c for c in cookies if c["name"] == "qrator_jsid"), None)
+        if cookie:
             logger.info(f"Получен cookie qrator_jsid: {cookie['value']}")
-            return cookie["value"]
+            return cookie
+        if loop.time() >= deadline:
+            break
+        await asyncio.sleep(COOKIE_POLL_INTERVAL)
     logger.error("Cookie 'qrator_jsid' не найден!")
     return None
 
 
+class QratorRejected(Exception):
+    """Запрос отклонила защита qrator: cookie qrator_jsid больше не принимается."""
+
+
+def is_qrator_rejection(response):
+    """
+    401/403 с JSON приходит от API авторизации (например, неверный пароль).
+    Отказ qrator отдается страницей проверки, а не JSON.
+    """
+    if response.status_code not in (401, 403):
+        return False
+    return "json" not in response.headers.get("Content-Type", "")
+
+
 def authenticate_account(login, password, cookie_value):
     """
     Выполняет POST-запрос для аутентификации с использованием requests,
     устанавливая переданный cookie для домена pwa.velobike.ru.
     Возвращает token при успешном ответе, иначе None.
+    Если запрос отклонил qrator, сбрасывает cookie в кэше и поднимает
+    QratorRejected.
     """
-    session_requests = requests.Session()
-    session_requests.cookies.set("qrator_jsid", cookie_value, domain="pwa.velobike.ru")
     payload = {"user": login, "password": password}
 
     try:
-        response = session_requests.post(
+        response = SESSION.post(
             "https://pwa.velobike.ru/api/api-auth/authenticate",
             json=payload,
             headers=HEADERS,
+            cookies={"qrator_jsid": cookie_value},
+            timeout=AUTH_TIMEOUT,
         )
         if response.status_code == 200:
             data = response.json()
@@ -58,67 +134,156 @@ def authenticate_account(login, password, cookie_value):
                 return token
             else:
                 logger.error(f"Для {login} token не найден в ответе: {data}")
+        elif is_qrator_rejection(response):
+            # Cookie больше не принимается: следующий аккаунт получит новый
+            invalidate_qrator_cookie(cookie_value)
+            raise QratorRejected(
+                f"qrator отклонил запрос для {login}. Код: {response.status_code}"
+            )
         else:
             logger.error(
                 f"Ошибка аутентификации для {login}. Код: {response.status_code}. Ответ: {response.text}"
             )
+    except QratorRejected:
+        raise
     except Exception as e:
         logger.error(f"Исключение при аутентификации для {login}: {e}")
     return None
 
 
-def handle_request(route, request):
-    print("Headers:", request.headers)
-    route.continue_()
+# ---------------------------
+# Кэш cookie qrator_jsid
+# ---------------------------
+# Cookie защиты qrator не привязан к аккаунту, поэтому один раз полученный
+# в браузере cookie используется для всех аккаунтов, пока не истечет срок
+# или qrator не отклонит запрос с ним. Браузер открывается только за новым cookie.
+QRATOR_COOKIE_TTL = 600
+_qrator_cookie = {"value": None, "exp": 0.0}
+_qrator_lock = asyncio.Lock()
+
+
+def cached_qrator_cookie():
+    if time.time() < _qrator_cookie["exp"]:
+        return _qrator_cookie["value"]
+    return None
+
 
+def store_qrator_cookie(cookie):
+    exp = time.time() + QRATOR_COOKIE_TTL
+    # expires == -1 у сессионного cookie
+    if cookie.get("expires", -1) > 0:
+        exp = min(exp, cookie["expires"])
+    _qrator_cookie.update(value=cookie["value"], exp=exp)
 
-def main():
+
+def invalidate_qrator_cookie(value):
+    if _qrator_cookie["value"] == value:
+        _qrator_cookie.update(value=None, exp=0.0)
+
+
+async def obtain_qrator_cookie(context):
+    """
+    Возвращает действующий qrator_jsid из кэша или получает новый, открывая
+    страницу в постоянном контексте браузера. Блокировка не дает нескольким
+    аккаунтам открывать страницу одновременно ради одного и того же cookie.
+    """
+    async with _qrator_lock:
+        cookie_value = cached_qrator_cookie()
+        if cookie_value:
+            return cookie_value
+        page = await context.new_page()
+        try:
+            await page.goto(VELOBIKE_URL, timeout=30000)
+            if not await wait_for_page_load(page):
+                return None
+            cookie = await get_qrator_cookie(page)
+            if not cookie:
+                return None
+            store_qrator_cookie(cookie)
+            return cookie["value"]
+        finally:
+            await page.close()
+            # Следующая загрузка страницы должна получить новый cookie
+            await context.clear_cookies()
+
+
+async def refresh_account(context, account):
+    """
+    Получает новые cookie и token одного аккаунта. Браузер нужен только если
+    в кэше нет действующего qrator_jsid. Возвращает строку для
+    update_accounts_bulk или None при ошибке.
+    """
+    logger.info(f"Обработка аккаунта: {account.login}")
+    try:
+        cookie_value = await obtain_qrator_cookie(context)
+        if not cookie_value:
+            logger.error(
+                f"Не удалось получить cookie для {account.login}. Пропускаем аккаунт."
+            )
+            return
+
+        # requests синхронный: выполняем запрос в потоке,
+        # чтобы не останавливать обработку остальных аккаунтов
+        try:
+            token = await asyncio.to_thread(
+                authenticate_account, account.login, account.password, cookie_value
+            )
+        except QratorRejected as e:
+            # Повторяем один раз со свежим cookie. Ошибку API авторизации
+            # (например, неверный пароль) не повторяем, чтобы не множить
+            # неудачные входы в аккаунт
+            logger.warning(f"{e}. Повтор с новым cookie.")
+            cookie_value = await obtain_qrator_cookie(context)
+            if not cookie_value:
+                logger.error(
+                    f"Не удалось получить cookie для {account.login}. Пропускаем аккаунт."
+                )
+                return
+            token = await asyncio.to_thread(
+                authenticate_account, account.login, account.password, cookie_value
+            )
+        if token:
+            logger.info(f"Данные успешно получены для {account.login}.")
+            return {"l": account.login, "c": cookie_value, "t": token}
+        else:
+            logger.error(f"Не удалось получить token для {account.login}.")
+    except Exception as e:
+        logger.error(f"Ошибка при обработке аккаунта {account.login}: {e}")
+
+
+async def main():
     # Получаем список всех аккаунтов из базы данных
     accounts = get_all_accounts()
     logger.info(f"Найдено {len(accounts)} аккаунтов для обработки.")
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch_persistent_context(
+    async with async_playwright() as p:
+        browser = await p.chromium.launch_persistent_context(
             user_data_dir="chrome", headless=False, no_viewport=True, channel="chrome"
         )
-        page = browser.new_page()
+        await browser.route("**/*", block_resources)
         logger.info("Playwright браузер запущен.")
 
-        for account in accounts:
-            logger.info(f"Обработка аккаунта: {account.login}")
-            try:
-                page.goto("https://pwa.velobike.ru", timeout=30000)
-
-                if not wait_for_page_load(page):
-                    logger.error(
-                        f"Страница не загрузилась для {account.login}. Пропускаем аккаунт."
-                    )
-                    continue
-
-                cookie_value = get_qrator_cookie(page)
-                if not cookie_value:
-                    logger.error(
-                        f"Не удалось получить cookie для {account.login}. Пропускаем аккаунт."
-                    )
-                    continue
-
-                token = authenticate_account(
-                    account.login, account.password, cookie_value
-                )
-                if token:
-                    update_account(account.login, cookie=cookie_value, token=token)
-                    logger.info(f"Данные успешно обновлены для {account.login}.")
-                else:
-                    logger.error(f"Не удалось получить token для {account.login}.")
-            except Exception as e:
-                logger.error(f"Ошибка при обработке аккаунта {account.login}: {e}")
-            finally:
-                browser.clear_cookies()
-                logger.info("Очистка куки браузера выполнена для следующего аккаунта.")
-
-        browser.close()
+        # Один браузер на все аккаунты; одновременно обрабатывается
+        # не больше REFRESH_CONCURRENCY аккаунтов
+        semaphore = asyncio.Semaphore(REFRESH_CONCURRENCY)
+
+        async def run(account):
+            async with semaphore:
+                return await refresh_account(browser, account)
+
+        results = await asyncio.gather(*(run(account) for account in accounts))
+        # Все полученные данные записываются в БД одной транзакцией
+        update_accounts_bulk([row for row in results if row])
+
+        await browser.close()
         logger.info("Обработка всех аккаунтов завершена.")
 
 
 if __name__ == "__main__":
-    main()
+    # uvloop быстрее стандартного цикла событий, но под Windows недоступен
+    if sys.platform != "win32":
+        import uvloop
+
+        uvloop.run(main())
+    else:
+        asyncio.run(main())